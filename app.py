@@ -36,7 +36,7 @@ if not app.secret_key:
 genai_client = Client(api_key=os.environ.get('GOOGLE_AI_API_KEY'))
 
 # Import database and authentication utilities
-from database import db
+from database import db, DOCTOR_TITLES
 from auth_utils import validate_email, validate_password, get_medical_fields, get_medical_fields_for_language
 
 # Import i18n manager
@@ -323,25 +323,11 @@ def get_doctor_titles_for_language(language='en'):
     # Get the title translations for the current language
     title_translations = i18n.translations.get(language, {}).get('auth', {}).get('doctorTitles', {})
     
-    # Base titles (keys)
-    base_titles = [
-        "Dr.",
-        "Prof. Dr.",
-        "Doç. Dr.",
-        "Öğr. Gör. Dr.",
-        "Uzm. Dr.",
-        "Op. Dr.",
-        "Dt.",
-        "Vet.",
-        "Ebe",
-        "Hemşire"
-    ]
-    
     # Return translated titles if available, otherwise return base titles
     if title_translations:
-        return [(title, title_translations.get(title, title)) for title in base_titles]
+        return [(title, title_translations.get(title, title)) for title in DOCTOR_TITLES]
     else:
-        return [(title, title) for title in base_titles]
+        return [(title, title) for title in DOCTOR_TITLES]
 
 @app.route('/register', methods=['GET', 'POST'])
 def register():
@@ -384,10 +370,6 @@ def register():
         if form_data['password'] != form_data['confirm_password']:
             errors.append(i18n.t('auth.passwordsNoMatch'))
         
-        # Check if user already exists
-        if form_data['email'] and db.get_user_by_email(form_data['email']):
-            errors.append(i18n.t('auth.accountExists'))
-        
         # Years of experience validation
         try:
             years_exp = int(form_data['years_experience'])
@@ -415,10 +397,16 @@ def register():
                 phone=form_data['phone'],
                 doctor_title=form_data['doctor_title']
                 )
+            if user_id is None:
+                flash(i18n.t('auth.accountExists'), 'error')
+                return render_template('register.html', medical_fields=get_medical_fields_for_language(i18n.get_current_language()), doctor_titles=get_doctor_titles_for_language(i18n.get_current_language()), form_data=form_data)
             flash(i18n.t('auth.registrationSuccess'), 'success')
             return redirect(url_for('login'))
         except Exception as e:
-            flash(i18n.t('auth.registrationFailed', error=str(e)), 'error')
+            # Keep driver/connector details in the server log, not the page
+            print(f"Registration error: {e}")
+            traceback.print_exc()
+            flash(i18n.t('auth.registrationFailed'), 'error')
             return render_template('register.html', medical_fields=get_medical_fields_for_language(i18n.get_current_language()), doctor_titles=get_doctor_titles_for_language(i18n.get_current_language()), form_data=form_data)
     
     return render_template('register.html', medical_fields=get_medical_fields_for_language(i18n.get_current_language()), doctor_titles=get_doctor_titles_for_language(i18n.get_current_language()))
@@ -2,61 +2,224 @@
 Database configuration and utilities for PostgreSQL using Cloud SQL Connector
 """
 import os
+import sys
+import asyncio
+import hashlib
+import hmac
+import threading
+import time
 import bcrypt
-import psycopg2
-import psycopg2.extras
+import pg8000.native
+import sqlalchemy
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
-from typing import Dict, Any, List, Optional
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Optional, Tuple
 
 from google.cloud.sql.connector import Connector, IPTypes
 
 
+@dataclass(frozen=True)
+class DatabaseConfig:
+    db_user: str
+    db_pass: str = field(repr=False)
+    db_name: str
+    instance_connection_name: str
+    ip_type: IPTypes
+    bcrypt_rounds: int
+
+
+def _load_db_config() -> DatabaseConfig:
+    """Read the database settings from the environment, failing on any missing value"""
+    values = {
+        name: os.environ.get(name, '').strip()
+        for name in ('DB_USER', 'DB_PASS', 'DB_NAME', 'CLOUD_SQL_CONNECTION_NAME')
+    }
+    missing = [name for name, value in values.items() if not value]
+    if missing:
+        raise ValueError(f"Missing database environment variables: {', '.join(missing)}")
+
+    ip_type_name = os.environ.get('CLOUD_SQL_IP_TYPE', 'PRIVATE').strip().upper()
+    if ip_type_name not in IPTypes.__members__:
+        raise ValueError(f"Invalid CLOUD_SQL_IP_TYPE '{ip_type_name}'; expected one of {', '.join(IPTypes.__members__)}")
+
+    bcrypt_rounds_value = os.environ.get('BCRYPT_ROUNDS', '12').strip()
+    try:
+        bcrypt_rounds = int(bcrypt_rounds_value)
+    except ValueError:
+        bcrypt_rounds = None
+    if bcrypt_rounds is None or not 4 <= bcrypt_rounds <= 31:
+        raise ValueError(f"Invalid BCRYPT_ROUNDS '{bcrypt_rounds_value}'; expected an integer from 4 to 31")
+
+    return DatabaseConfig(
+        db_user=values['DB_USER'],
+        db_pass=values['DB_PASS'],
+        db_name=values['DB_NAME'],
+        instance_connection_name=values['CLOUD_SQL_CONNECTION_NAME'],
+        ip_type=IPTypes[ip_type_name],
+        bcrypt_rounds=bcrypt_rounds,
+    )
+
+
+# Parsed once at import so a misconfigured revision fails at startup rather
+# than on the first request that needs the database.
+_CFG = _load_db_config()
+
+# One Connector per process: it owns the ephemeral-certificate cache and
+# refresh logic for every pooled connection. Private IP keeps traffic inside
+# the VPC; CLOUD_SQL_IP_TYPE=PUBLIC is available for deployments without one.
+# Lazy refresh fetches certificates only when a connection is opened, so an
+# idle instance runs no background refresh.
+_CONNECTOR = Connector(ip_type=_CFG.ip_type, refresh_strategy="lazy")
+
+# How long a successful verify_user result is reused before bcrypt runs again
+SESSION_CACHE_TTL_SECONDS = 300
+SESSION_CACHE_MAX_ENTRIES = 10_000
+
+# How long get_user_by_id / get_user_by_email results are served from memory
+USER_CACHE_TTL_SECONDS = 30
+USER_CACHE_MAX_ENTRIES = 10_000
+
+
+DOCTOR_TITLES: Tuple[str, ...] = (
+    "Dr.", "Prof. Dr.", "Doç. Dr.", "Öğr. Gör. Dr.", "Uzm. Dr.",
+    "Op. Dr.", "Dt.", "Vet.", "Ebe", "Hemşire",
+)
+
+# Column order of the user SELECTs; rows come back as plain tuples and are
+# zipped against these names.
+_USER_COLUMNS = (
+    "id", "first_name", "last_name", "email", "medical_field",
+    "organization", "diploma_number", "doctor_title",
+)
+# password_hash last, so zipping a login row against _USER_COLUMNS drops it
+_LOGIN_COLUMNS = _USER_COLUMNS + ("password_hash",)
+
+# Single-user lookups, built once here and prepared once per pooled
+# connection (see _prepared_statement)
+_SELECT_ACTIVE_USER = "SELECT {columns} FROM users WHERE {predicate} AND is_active = TRUE LIMIT 1"
+_USER_BY_EMAIL_SQL = _SELECT_ACTIVE_USER.format(columns=", ".join(_USER_COLUMNS), predicate="email = :email")
+_USER_BY_ID_SQL = _SELECT_ACTIVE_USER.format(columns=", ".join(_USER_COLUMNS), predicate="id = :user_id")
+_LOGIN_BY_EMAIL_SQL = _SELECT_ACTIVE_USER.format(columns=", ".join(_LOGIN_COLUMNS), predicate="email = :email")
+
+
+class _TTLCache:
+    """Thread-safe in-process cache whose entries expire after a fixed TTL.
+
+    Every entry gets the same TTL and is moved to the end when set, so
+    insertion order is also expiry order: the oldest entry is always first.
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._entries: "OrderedDict[Any, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                del self._entries[key]
+                return None
+            return entry[0]
+
+    def set(self, key, value) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._entries.pop(key, None)
+            # Drop expired entries, then the oldest live ones, to stay under the cap
+            while self._entries and (
+                len(self._entries) >= self._max_entries
+                or next(iter(self._entries.values()))[1] <= now
+            ):
+                self._entries.popitem(last=False)
+            self._entries[key] = (value, now + self._ttl)
+
+
 class DatabaseManager:
     def __init__(self):
-        # Variables from the first code snippet
-        self.db_user = os.environ.get('DB_USER', '').strip()         
-        self.db_pass = os.environ.get('DB_PASS', '').strip()
-        self.db_name = os.environ.get("DB_NAME", '').strip()
-        self.instance_connection_name = os.environ.get("CLOUD_SQL_CONNECTION_NAME", '').strip()
+        self._cfg = _CFG
+
+        self.connector = _CONNECTOR
 
-        self.connector = Connector()
+        # bcrypt cost factor; tunable per deployment without a code change.
+        # The dummy hash below always uses this cost, while stored hashes keep
+        # the cost they were created with until verify_user rehashes them on
+        # the user's next successful login. After changing BCRYPT_ROUNDS,
+        # unknown and existing emails only take equal time again once users
+        # have logged in and been rehashed.
+        self._bcrypt_rounds = self._cfg.bcrypt_rounds
 
-        self.init_tables()
+        # bcrypt's C extension releases the GIL, so hashing on these threads
+        # runs on all cores in parallel.
+        self._bcrypt_pool = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="bcrypt")
+
+        # Successful logins keyed by an HMAC of (email, password) under a
+        # per-process secret, so plain password digests are never held.
+        self._session_cache = _TTLCache(SESSION_CACHE_TTL_SECONDS, SESSION_CACHE_MAX_ENTRIES)
+        self._session_cache_secret = os.urandom(32)
+
+        # Recent profile lookups, keyed by id and by email
+        self._user_by_id_cache = _TTLCache(USER_CACHE_TTL_SECONDS, USER_CACHE_MAX_ENTRIES)
+        self._user_by_email_cache = _TTLCache(USER_CACHE_TTL_SECONDS, USER_CACHE_MAX_ENTRIES)
+
+        # Checked against when the email is unknown, so a missing user costs
+        # the same bcrypt time as a wrong password.
+        self._dummy_password_hash = self._hash_password(os.urandom(16).hex().encode('utf-8'))
+
+        # Process-wide pool: connections are opened through the Cloud SQL
+        # Connector only when the pool needs a new one, then reused. Pooled
+        # connections autocommit, so single-statement reads and writes skip the
+        # extra BEGIN round trip; multi-statement writes issue BEGIN themselves.
+        self.engine = sqlalchemy.create_engine(
+            "postgresql+pg8000://",
+            creator=self._getconn,
+            isolation_level="AUTOCOMMIT",
+            pool_size=5,
+            max_overflow=10,
+            pool_pre_ping=True,
+            pool_recycle=1800,
+        )
 
         print("✅ DatabaseManager initialized for Cloud SQL.")
 
 
+    def _getconn(self):
+        """Open a new DBAPI connection through the Cloud SQL Connector (used by the pool)"""
+        return self.connector.connect(
+            self._cfg.instance_connection_name,
+            "pg8000",
+            user=self._cfg.db_user,
+            password=self._cfg.db_pass,
+            db=self._cfg.db_name,
+        )
+
     @contextmanager
     def get_connection(self):
-        """Get database connection with context manager using Cloud SQL Connector"""
-        conn = None
-        try:
-            conn = self.connector.connect(
-                self.instance_connection_name,
-                "pg8000",
-                user=self.db_user,
-                password=self.db_pass,
-                db=self.db_name,
-#               ip_type=IPTypes.PRIVATE,
-#               cursor_factory=psycopg2.extras.RealDictCursor
-            )
-            self.verify_database_connection()
-            yield conn
-        except Exception as e:
-            if conn:
+        """Check out a pooled database connection; it is returned to the pool on exit.
+
+        The yielded connection proxies the DBAPI connection (cursor, commit,
+        rollback) and exposes the statements prepared for it through `.info`.
+        """
+        with self.engine.connect() as pooled:
+            conn = pooled.connection
+            try:
+                yield conn
+            except Exception as e:
                 conn.rollback()
-            print(f"❌ Database connection error: {e}")
-            raise e
-        finally:
-            if conn:
-                conn.close()
+                print(f"❌ Database connection error: {e}")
+                raise e
                 
                 
                 
     def verify_database_connection(self):
         try:
        
-            print(f"Attempting to verify connection to database '{self.db_name}'...")
+            print(f"Attempting to verify connection to database '{self._cfg.db_name}'...")
         
             with self.get_connection() as conn:
                 # Bağlantı başarılı olursa, basit bir sorgu çalıştırarak teyit et.
@@ -65,16 +228,16 @@ class DatabaseManager:
                 result = cursor.fetchone()
             
             if result:
-                print(f"✅ Successfully connected to database '{self.db_name}'. Connection is valid.")
+                print(f"✅ Successfully connected to database '{self._cfg.db_name}'. Connection is valid.")
                 return True
             else:
                 # Bu durumun gerçekleşmesi çok olası değil ama her ihtimale karşı.
-                print(f"⚠️  Connected to '{self.db_name}', but test query failed.")
+                print(f"⚠️  Connected to '{self._cfg.db_name}', but test query failed.")
                 return False
 
         except Exception as e:
             # get_connection içinde zaten bir hata loglaması var, ama burada daha spesifik bir mesaj verelim.
-            print(f"❌ FAILED to connect to database '{self.db_name}': {e}")
+            print(f"❌ FAILED to connect to database '{self._cfg.db_name}': {e}")
             print("Please check the following:")
             print("1. The database name in your environment variables is correct.")
             print("2. The Cloud SQL instance is running.")
@@ -84,11 +247,15 @@ class DatabaseManager:
             return False
                 
     
-    def init_tables(self):
-        """Initialize database tables"""
+    def init_tables(self) -> bool:
+        """Initialize database tables.
+
+        Not run on startup; invoke once per deploy with `python database.py migrate`.
+        """
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
+                cursor.execute("BEGIN")
 
                 # Create users table
                 cursor.execute("""
@@ -129,14 +296,18 @@ class DatabaseManager:
                 """)
                 '''
 
-                # Create index on email for faster lookups
-                cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_email ON users(email)")
+                # Partial index matching the hot lookups (email = ? AND is_active);
+                # the plain email index duplicated the UNIQUE constraint's index.
+                cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email_active ON users(email) WHERE is_active = TRUE")
+                cursor.execute("DROP INDEX IF EXISTS idx_users_email")
 
                 conn.commit()
                 print("✅ Database tables initialized successfully")
+                return True
 
         except Exception as e:
             print(f"❌ Error initializing tables: {e}")
+            return False
             
         
     '''
@@ -186,82 +357,205 @@ class DatabaseManager:
     
 
 
+    def _hash_password(self, password: bytes) -> str:
+        return bcrypt.hashpw(password, bcrypt.gensalt(rounds=self._bcrypt_rounds)).decode('utf-8')
+
+    @staticmethod
+    def _check_password(password: bytes, password_hash: str) -> bool:
+        return bcrypt.checkpw(password, password_hash.encode('utf-8'))
+
+    async def hash_password_async(self, password: str) -> str:
+        """Hash a password on the bcrypt thread pool without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._bcrypt_pool, self._hash_password, password.encode('utf-8'))
+
+    async def check_password_async(self, password: str, password_hash: str) -> bool:
+        """Check a password on the bcrypt thread pool without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._bcrypt_pool, self._check_password, password.encode('utf-8'), password_hash)
+
     def create_user(self, email: str, password: str, first_name: str, last_name: str,
                    medical_field: str, organization: str, diploma_number: str,
                    years_experience: int = 0, phone: str = "", doctor_title: str = "Dr.") -> Optional[int]:
-        """Create a new user"""
+        """Create a new user and return its id.
+
+        Returns None only when the email is already registered; any other
+        failure (database or connector errors) is raised to the caller.
+        """
         try:
-            password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+            password_hash = self._hash_password(password.encode('utf-8'))
             name_surname = f"{first_name} {last_name}"
             with self.get_connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute("""
                     INSERT INTO users (name_surname, email, password_hash, medical_field, organization, diploma_number, first_name, last_name, years_experience, phone, doctor_title)
                     VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    ON CONFLICT (email) DO NOTHING
                     RETURNING id
                 """, (name_surname, email, password_hash, medical_field, organization, diploma_number, first_name, last_name, years_experience, phone, doctor_title))
-                user_id = cursor.fetchone()[0]
-                conn.commit()
-                return user_id
-        except psycopg2.IntegrityError:
-            return None
+                row = cursor.fetchone()
+                return row[0] if row else None
         except Exception as e:
             print(f"❌ Error creating user: {e}")
-            return None
+            raise e
+
+    def create_users_bulk(self, users: List[Dict[str, Any]], page_size: int = 500) -> List[Tuple[int, str]]:
+        """Create many users with one multi-row INSERT per page of rows.
+
+        Each dict takes the same keys as create_user's arguments. Returns an
+        (id, email) pair for every user created; emails that are already
+        registered are skipped, so they are the ones missing from the result.
+        The whole batch is committed at once. Any other error is raised and
+        nothing is inserted.
+        """
+        try:
+            password_hashes = self._bcrypt_pool.map(self._hash_password, [user['password'].encode('utf-8') for user in users])
+            rows = []
+            for user, password_hash in zip(users, password_hashes):
+                first_name = user['first_name']
+                last_name = user['last_name']
+                rows.append((
+                    f"{first_name} {last_name}", user['email'], password_hash,
+                    user['medical_field'], user['organization'], user['diploma_number'],
+                    first_name, last_name, user.get('years_experience', 0),
+                    user.get('phone', ""), user.get('doctor_title', "Dr."),
+                ))
+
+            created = []
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("BEGIN")
+                for start in range(0, len(rows), page_size):
+                    page = rows[start:start + page_size]
+                    values = ", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"] * len(page))
+                    cursor.execute(f"""
+                        INSERT INTO users (name_surname, email, password_hash, medical_field, organization, diploma_number, first_name, last_name, years_experience, phone, doctor_title)
+                        VALUES {values}
+                        ON CONFLICT (email) DO NOTHING
+                        RETURNING id, email
+                    """, tuple(value for row in page for value in row))
+                    created.extend((row[0], row[1]) for row in cursor.fetchall())
+                conn.commit()
+                return created
+        except Exception as e:
+            print(f"❌ Error creating users in bulk: {e}")
+            raise e
 
     def verify_user_credentials(self, email: str, password: str) -> Optional[Dict[str, Any]]:
         """Verify user credentials and return user data if valid."""
         return self.verify_user(email, password)
 
+    def _cache_user(self, user: Dict[str, Any]) -> None:
+        self._user_by_id_cache.set(user['id'], user)
+        self._user_by_email_cache.set(user['email'], user)
+
     def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        cached = self._user_by_email_cache.get(email)
+        if cached:
+            return dict(cached)
         try:
             with self.get_connection() as conn:
-                # DEĞİŞİKLİK: İmleci RealDictCursor olarak ayarlayın
-                cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-                cursor.execute("""
-                    SELECT id, first_name, last_name, email, medical_field, organization, diploma_number, doctor_title
-                    FROM users
-                    WHERE email = %s AND is_active = TRUE
-                """, (email,))
-                user = cursor.fetchone()
-                # Artık 'user' zaten bir sözlük olduğu için dict() çağırmaya gerek yok
-                return user if user else None
+                rows = self._prepared_statement(conn, _USER_BY_EMAIL_SQL).run(email=email)
+                if not rows:
+                    return None
+                row = rows[0]
+                user = dict(zip(_USER_COLUMNS, row))
+                self._cache_user(user)
+                return dict(user)
         except Exception as e:
             print(f"❌ Error getting user by email: {e}")
             return None
 
+    def _session_cache_key(self, email: str, password: bytes) -> str:
+        message = email.encode('utf-8') + b"\0" + password
+        return hmac.new(self._session_cache_secret, message, hashlib.sha256).hexdigest()
+
     def verify_user(self, email: str, password: str) -> Optional[Dict[str, Any]]:
-        """Verify a user's email and password."""
+        """Verify a user's email and password.
+
+        A successful result is cached for SESSION_CACHE_TTL_SECONDS so repeated
+        checks of the same credentials skip the database and bcrypt.
+        """
+        password_bytes = password.encode('utf-8')
+        cache_key = self._session_cache_key(email, password_bytes)
+        cached = self._session_cache.get(cache_key)
+        if cached:
+            return dict(cached)
+
         try:
             with self.get_connection() as conn:
-                cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-                cursor.execute("""
-                    SELECT id, first_name, last_name, email, password_hash, medical_field, organization, diploma_number, doctor_title
-                    FROM users
-                    WHERE email = %s AND is_active = TRUE
-                """, (email,))
-                user = cursor.fetchone()
-                if user and bcrypt.checkpw(password.encode('utf-8'), user['password_hash'].encode('utf-8')):
-                    user_data = dict(user)
-                    del user_data['password_hash']  # Do not send the hash to the client
-                    return user_data
-                return None
+                rows = self._prepared_statement(conn, _LOGIN_BY_EMAIL_SQL).run(email=email)
         except Exception as e:
             print(f"❌ Error verifying user: {e}")
             return None
 
+        # bcrypt runs after the connection is back in the pool
+        try:
+            row = rows[0] if rows else None
+            stored_hash = row[-1] if row else self._dummy_password_hash
+            password_ok = self._check_password(password_bytes, stored_hash)
+            if not (row and password_ok):
+                return None
+            user_data = dict(zip(_USER_COLUMNS, row))  # Stops before password_hash
+            self._rehash_if_needed(user_data['id'], password_bytes, stored_hash)
+        except Exception as e:
+            print(f"❌ Error checking user password: {e}")
+            return None
+        self._session_cache.set(cache_key, user_data)
+        return dict(user_data)
+
+    def _rehash_if_needed(self, user_id: int, password: bytes, stored_hash: str) -> None:
+        """Re-hash a verified password whose stored cost differs from BCRYPT_ROUNDS.
+
+        Keeps every stored hash at the dummy hash's cost, so a wrong password
+        and an unknown email take the same time. Failures are logged only;
+        the login itself has already succeeded.
+        """
+        try:
+            stored_rounds = int(stored_hash.split('$')[2])
+        except (IndexError, ValueError):
+            stored_rounds = None
+        if stored_rounds == self._bcrypt_rounds:
+            return
+        try:
+            new_hash = self._hash_password(password)
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "UPDATE users SET password_hash = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s",
+                    (new_hash, user_id),
+                )
+        except Exception as e:
+            print(f"❌ Error rehashing password for user {user_id}: {e}")
+
+    @staticmethod
+    def _prepared_statement(conn, query: str) -> pg8000.native.PreparedStatement:
+        """Return `query` prepared on this pooled connection, preparing it on first use.
+
+        Prepared lazily rather than on pool connect so a fresh database can still
+        be migrated before the users table exists.
+        """
+        statements = conn.info.setdefault("prepared_statements", {})
+        statement = statements.get(query)
+        if statement is None:
+            statement = pg8000.native.PreparedStatement(conn.dbapi_connection, query)
+            statements[query] = statement
+        return statement
+
     def get_user_by_id(self, user_id: int) -> Optional[Dict[str, Any]]:
         """Get user details by their user ID."""
+        cached = self._user_by_id_cache.get(user_id)
+        if cached:
+            return dict(cached)
         try:
             with self.get_connection() as conn:
-                cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-                cursor.execute("""
-                    SELECT id, first_name, last_name, email, medical_field, organization, diploma_number, doctor_title
-                    FROM users
-                    WHERE id = %s AND is_active = TRUE
-                """, (user_id,))
-                user = cursor.fetchone()
-                return user if user else None
+                rows = self._prepared_statement(conn, _USER_BY_ID_SQL).run(user_id=user_id)
+                if not rows:
+                    return None
+                row = rows[0]
+                user = dict(zip(_USER_COLUMNS, row))
+                self._cache_user(user)
+                return dict(user)
         except Exception as e:
             print(f"❌ Error getting user by ID: {e}")
             return None
@@ -271,18 +565,22 @@ class DatabaseManager:
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
-                cursor.execute("SELECT 1 FROM users WHERE email = %s", (email,))
-                return cursor.fetchone() is not None
+                cursor.execute("SELECT EXISTS(SELECT 1 FROM users WHERE email = %s)", (email,))
+                return cursor.fetchone()[0]
         except Exception as e:
             print(f"❌ Error checking for email existence: {e}")
             return False
 
-    def get_doctor_titles(self) -> List[str]:
-        """Returns a static list of predefined doctor titles."""
-        return [
-            "Dr.", "Prof. Dr.", "Doç. Dr.", "Öğr. Gör. Dr.", "Uzm. Dr.",
-            "Op. Dr.", "Dt.", "Vet.", "Ebe", "Hemşire"
-        ]
+    def get_doctor_titles(self) -> Tuple[str, ...]:
+        """Returns the predefined doctor titles."""
+        return DOCTOR_TITLES
 
 # Global database instance
-db = DatabaseManager()
\ No newline at end of file
+db = DatabaseManager()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["migrate"]:
+        print("Usage: python database.py migrate")
+        sys.exit(2)
+    sys.exit(0 if db.init_tables() else 1)